@@ -1,28 +1,246 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import zstandard
 import zipfile
-from io import BytesIO
+import csv
+import functools
+from io import BytesIO, StringIO
 import os
+import re
+import tempfile
 import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime
 
-def create_zip_download(csv_files):
-    """Create a ZIP file containing all CSV files for download"""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for filename, csv_content in csv_files:
-            zip_file.writestr(filename, csv_content)
-    zip_buffer.seek(0)
-    return zip_buffer
+# Rows read up front for the data preview and column discovery
+PREVIEW_ROWS = 1000
+
+# How often the page checks on a running split job
+JOB_POLL_SECONDS = 0.25
+
+# Worker threads used to serialize CSV files
+SERIALIZE_WORKERS = os.cpu_count() or 1
+
+# Filename sanitization: keep letters, digits, '_' and '-'
+FILENAME_SEPARATORS = str.maketrans({" ": "_", "/": "_"})
+FILENAME_UNSAFE_CHARS = re.compile(r"[^\w-]")
+
+# ZIP archives larger than this spill from memory to a temporary file on disk
+ZIP_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Consecutive files serialized together in one pass
+FILES_PER_BATCH = 64
+
+# CSV text is written the way pandas' to_csv writes it: minimal quoting, one line ending per row
+CSV_LINE_TERMINATOR = os.linesep
+CSV_SEPARATOR = pa.scalar(",", pa.large_string())
+CSV_QUOTE = pa.scalar('"', pa.large_string())
+CSV_EMPTY = pa.scalar("", pa.large_string())
+
+def csv_quote_chars():
+    """Find the characters that make Python's csv module, and so pandas' to_csv, quote a value"""
+    # Whether '\r' is quoted depends on the Python version and line terminator, so ask csv itself
+    quote_chars = []
+    for char in ',"\r\n':
+        buffer = StringIO()
+        csv.writer(buffer, lineterminator=CSV_LINE_TERMINATOR).writerow([char, ""])
+        if buffer.getvalue().startswith('"'):
+            quote_chars.append(char)
+    return quote_chars
+
+CSV_QUOTE_CHARS = csv_quote_chars()
+
+# Timestamp types pandas' formats correspond to: dates only, or seconds down to nanoseconds
+TIMESTAMP_FORMATS = [pa.date32(), pa.timestamp("s"), pa.timestamp("ms"), pa.timestamp("us"), pa.timestamp("ns")]
+
+def format_floats(column):
+    """Format a float column like numpy's repr, which pandas' to_csv uses: 1.0, 0.1, 1e-05"""
+    values = column.to_numpy(zero_copy_only=False)
+    if column.type != pa.float64():
+        return pa.array(values.astype(str), mask=np.isnan(values)).cast(pa.large_string())
+    
+    # Arrow writes the same shortest digits, but drops the '.0' from whole numbers
+    text = pc.cast(column, pa.large_string())
+    text = pc.if_else(pc.match_substring(text, "."), text, pc.binary_join_element_wise(text, pa.scalar(".0", pa.large_string()), CSV_EMPTY))
+    
+    # Outside numpy's fixed-notation range the exponent formats differ, so let numpy render those few values
+    with np.errstate(invalid="ignore"):
+        magnitude = np.abs(values)
+        fixed = (values == 0) | (magnitude >= 1e-4) & (magnitude < 1e16)
+    exponent = pc.match_substring(text, "e").fill_null(False).to_numpy(zero_copy_only=False)
+    fallback = (~fixed | exponent) & ~np.isnan(values)
+    if fallback.any():
+        text = pc.replace_with_mask(text, pa.array(fallback), pa.array(values[fallback].astype(str)).cast(pa.large_string()))
+    return text
+
+def format_timestamps(column, file_starts):
+    """Format a timestamp column like pandas' to_csv, choosing the format separately for every file"""
+    units_per_second = {"s": 1, "ms": 10**3, "us": 10**6, "ns": 10**9}[column.type.unit]
+    values = pc.cast(column, pa.int64()).fill_null(0).to_numpy(zero_copy_only=False)
+    nanoseconds = values % units_per_second * (10**9 // units_per_second)
+    
+    # pandas drops the time when every value in the file is midnight, and only shows the sub-second digits it needs
+    off_midnight = np.logical_or.reduceat(values % (86400 * units_per_second) != 0, file_starts)
+    show_ns = np.logical_or.reduceat(nanoseconds % 1000 != 0, file_starts)
+    show_us = np.logical_or.reduceat(nanoseconds // 1000 % 1000 != 0, file_starts)
+    show_ms = np.logical_or.reduceat(nanoseconds // 10**6 != 0, file_starts)
+    file_formats = np.select([~off_midnight, show_ns, show_us, show_ms], [0, 4, 3, 2], default=1)
+    
+    # Render each format that is used once, then pick every row's format from its file
+    used_formats = np.unique(file_formats)
+    rendered = [
+        pc.cast(column.cast(TIMESTAMP_FORMATS[i], safe=False), pa.large_string())
+        for i in used_formats
+    ]
+    if len(rendered) == 1:
+        return rendered[0]
+    file_lengths = np.diff(np.append(file_starts, len(column)))
+    row_formats = np.repeat(np.searchsorted(used_formats, file_formats), file_lengths).astype(np.int8)
+    return pc.choose(pa.array(row_formats), *rendered)
+
+def format_with_pandas(column, file_starts):
+    """Format a column with pandas' own to_csv, one file at a time, for types without an Arrow handler"""
+    # pandas picks some formats per file (e.g. whether timedeltas show the time), so render each file separately
+    values = column.to_pandas()
+    file_ends = np.append(file_starts[1:], len(values))
+    text = []
+    for start, end in zip(file_starts.tolist(), file_ends.tolist()):
+        rendered = values.iloc[start:end].to_frame().to_csv(index=False, header=False, quoting=csv.QUOTE_ALL)
+        text.extend(row[0] for row in csv.reader(StringIO(rendered)))
+    return pa.array(text, pa.large_string())
+
+def quote_text(text):
+    """Quote the values csv would quote, doubling embedded quotes"""
+    needs_quotes = None
+    for char in CSV_QUOTE_CHARS:
+        contains = pc.match_substring(text, char)
+        needs_quotes = contains if needs_quotes is None else pc.or_(needs_quotes, contains)
+    quoted = pc.binary_join_element_wise(CSV_QUOTE, pc.replace_substring(text, '"', '""'), CSV_QUOTE, CSV_EMPTY)
+    return pc.if_else(needs_quotes, quoted, text)
+
+def format_csv_column(column, file_starts):
+    """Render one column as CSV text the way pandas' to_csv does; missing values stay null"""
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    
+    if pa.types.is_timestamp(column.type) and column.type.tz is None:
+        return format_timestamps(column, file_starts)
+    if pa.types.is_floating(column.type):
+        return format_floats(column)
+    if pa.types.is_boolean(column.type):
+        return pc.if_else(column, pa.scalar("True", pa.large_string()), pa.scalar("False", pa.large_string()))
+    if pa.types.is_integer(column.type):
+        return pc.cast(column, pa.large_string())
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return quote_text(pc.cast(column, pa.large_string()))
+    
+    # Durations, times and anything else: let pandas render the values, then quote them like strings
+    return quote_text(format_with_pandas(column, file_starts))
+
+def group_codes(table, group_columns):
+    """Number each row's group in order of first appearance; rows with a missing group key get -1"""
+    codes = None
+    has_key = np.ones(table.num_rows, dtype=bool)
+    for col in group_columns:
+        column = table.column(col).combine_chunks()
+        encoded = column if pa.types.is_dictionary(column.type) else pc.dictionary_encode(column)
+        has_key &= encoded.indices.is_valid().to_numpy(zero_copy_only=False)
+        indices = encoded.indices.fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+        
+        # Combine with the previous columns' codes, then renumber densely so codes never overflow
+        combined = indices if codes is None else codes * len(encoded.dictionary) + indices
+        codes = pc.dictionary_encode(pa.array(combined)).indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    
+    codes[~has_key] = -1
+    return codes
+
+def csv_header(schema):
+    """Serialize the CSV header line shared by every file"""
+    buffer = StringIO()
+    csv.writer(buffer, lineterminator=CSV_LINE_TERMINATOR).writerow(schema.names)
+    return buffer.getvalue().encode()
+
+def render_csv_batch(table, file_rows):
+    """Serialize consecutive (offset, row count) ranges in one pass and return each range's CSV body"""
+    # Files in a batch are adjacent slices of the sorted table, so format their rows together
+    batch_offset = file_rows[0][0]
+    batch_rows = sum(num_rows for _, num_rows in file_rows)
+    file_starts = np.array([offset - batch_offset for offset, _ in file_rows])
+    batch = table.slice(batch_offset, batch_rows)
+    
+    columns = [format_csv_column(column.combine_chunks(), file_starts) for column in batch.columns]
+    rows = pc.binary_join_element_wise(*columns, CSV_SEPARATOR, null_handling="replace", null_replacement="")
+    lines = pc.binary_join_element_wise(rows, CSV_EMPTY, pa.scalar(CSV_LINE_TERMINATOR, pa.large_string()))
+    
+    # Every line is contiguous in the string data, so each file's body is a slice of that buffer by line offsets
+    _, line_offsets, data = lines.buffers()
+    line_offsets = np.frombuffer(line_offsets, dtype=np.int64, count=batch_rows + 1, offset=lines.offset * 8)
+    boundaries = line_offsets[np.append(file_starts, batch_rows)].tolist()
+    body = memoryview(data)
+    return [body[start:end] for start, end in zip(boundaries, boundaries[1:])]
+
+def open_zip_archive(zip_buffer, use_zstd=False):
+    """Open a ZIP archive for writing with DEFLATE or Zstandard compression"""
+    if not use_zstd:
+        # Compress lightly: CSV text shrinks well even at the fastest DEFLATE level
+        return zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+    # Entries are compressed up front with zstandard and stored as-is
+    return zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED)
+
+def write_zip_entry(zip_file, filename, csv_bytes, date_time, compressor=None):
+    """Add one CSV file to the archive and return its name inside the archive"""
+    compress_type, compresslevel = zip_file.compression, zip_file.compresslevel
+    if compressor is not None:
+        # Already Zstandard-compressed: store as-is, zipfile only adds the CRC
+        filename = f"{filename}.zst"
+        csv_bytes = compressor.compress(csv_bytes)
+        compress_type, compresslevel = zipfile.ZIP_STORED, None
+    
+    # Entries share one timestamp instead of each reading the clock
+    info = zipfile.ZipInfo(filename, date_time=date_time)
+    info.external_attr = 0o644 << 16  # -rw-r--r--
+    zip_file.writestr(info, csv_bytes, compress_type=compress_type, compresslevel=compresslevel)
+    return filename
+
+def group_filename(group_name):
+    """Turn a group name (or tuple of names) into a safe filename stem"""
+    group_name_str = "_".join(map(str, group_name)) if isinstance(group_name, tuple) else str(group_name)
+    
+    # Spaces and slashes become underscores, then any other problematic character is removed
+    return FILENAME_UNSAFE_CHARS.sub("", group_name_str.translate(FILENAME_SEPARATORS))
+
+def iter_group_files(group_names, group_offsets, group_lengths, max_rows_per_file, filename_prefix=""):
+    """Yield (group index, group name, filename, row offset, row count, is last file of group) for every CSV file"""
+    for group_idx, (group_name, group_offset, num_rows) in enumerate(zip(group_names, group_offsets, group_lengths)):
+        group_name_str = group_filename(group_name)
+        
+        # Split group into multiple files if it exceeds max_rows_per_file
+        if num_rows <= max_rows_per_file:
+            # Single file for this group
+            yield group_idx, group_name, f"{filename_prefix}{group_name_str}.csv", group_offset, num_rows, True
+        else:
+            # Multiple files for this group: every chunk is full except possibly the last
+            chunk_offsets = np.arange(group_offset, group_offset + num_rows, max_rows_per_file)
+            chunk_lengths = np.minimum(max_rows_per_file, group_offset + num_rows - chunk_offsets)
+            num_chunks = len(chunk_offsets)
+            for i, (chunk_offset, chunk_rows) in enumerate(zip(chunk_offsets.tolist(), chunk_lengths.tolist())):
+                filename = f"{filename_prefix}{group_name_str}_part_{i+1}.csv"
+                yield group_idx, group_name, filename, chunk_offset, chunk_rows, i == num_chunks - 1
 
-def process_excel_data(df, group_columns, selected_columns, max_rows_per_file, progress_bar=None, status_text=None):
-    """Process the dataframe and create CSV files based on grouping criteria"""
-    # Filter dataframe to only include selected columns
-    df_filtered = df[selected_columns].copy()
+def plan_groups(df, group_columns, selected_columns, max_rows_per_file, on_progress=None, filename_prefix=""):
+    """Clean the dataframe and work out every CSV file the grouping criteria will create"""
+    # Filter dataframe to only include selected columns (column selection already returns a new frame)
+    df_filtered = df[selected_columns]
     
     # Remove empty rows before processing
-    if status_text:
-        status_text.text("🧹 Cleaning data: Removing empty rows...")
+    if on_progress:
+        on_progress(0.0, "🧹 Cleaning data: Removing empty rows...")
     
     # Count rows before cleaning
     rows_before = len(df_filtered)
@@ -38,6 +256,10 @@ def process_excel_data(df, group_columns, selected_columns, max_rows_per_file, p
         if df_filtered[col].dtype == 'object':  # Only for string columns
             df_filtered[col] = df_filtered[col].astype(str).str.strip()
             df_filtered = df_filtered[df_filtered[col] != '']
+        elif isinstance(df_filtered[col].dtype, pd.StringDtype):
+            # Arrow-backed strings: missing values become 'nan' like astype(str) above
+            df_filtered[col] = df_filtered[col].fillna('nan').str.strip()
+            df_filtered = df_filtered[df_filtered[col] != '']
     
     # Remove rows where all values are NaN, None, or empty strings
     df_filtered = df_filtered.replace('', pd.NA).dropna(how='all')
@@ -48,73 +270,155 @@ def process_excel_data(df, group_columns, selected_columns, max_rows_per_file, p
     rows_after = len(df_filtered)
     rows_removed = rows_before - rows_after
     
-    if status_text:
-        status_text.text(f"✅ Data cleaned: Removed {rows_removed} empty rows. Processing {rows_after} valid rows...")
+    if on_progress:
+        on_progress(0.0, f"✅ Data cleaned: Removed {rows_removed} empty rows. Processing {rows_after} valid rows...")
     
     # Brief pause to show cleaning status
     time.sleep(2)
     
-    # Create groups based on selected columns
+    # Keep the data columnar from here on: group, sort and serialize the Arrow table.
+    # The cleaned dataframe is a full copy of the working set, so release it right away
+    table = pa.Table.from_pandas(df_filtered, preserve_index=False)
+    
+    # Arrow stores header labels as strings, so refer to grouping columns by position
+    group_indices = [df_filtered.columns.get_loc(col) for col in group_columns]
+    del df_filtered
+    
+    # Create groups based on selected columns (in order of first appearance, skipping unused categories)
+    codes = group_codes(table, group_indices)
+    
+    # Sort rows once by group so that every group is a contiguous slice of the table
+    row_order = np.argsort(codes, kind="stable")
+    row_order = row_order[codes[row_order] >= 0]  # Rows with missing group keys belong to no group
+    _, group_offsets, group_lengths = np.unique(codes[row_order], return_index=True, return_counts=True)
+    table = table.take(row_order)  # Also drops the unsorted table
+    del codes, row_order
+    
+    # Group names come from the first row of each group
+    group_keys = [column.to_pylist() for column in table.select(group_indices).take(group_offsets).columns]
     if len(group_columns) == 1:
-        grouped = df_filtered.groupby(group_columns[0])
+        group_names = group_keys[0]
     else:
-        grouped = df_filtered.groupby(group_columns)
+        group_names = list(zip(*group_keys))
     
-    csv_files = []
-    total_groups = 0
-    total_files = 0
-    
-    # Get total number of groups for progress tracking
-    total_expected_groups = len(grouped)
+    return {
+        "table": table,
+        "files": list(iter_group_files(group_names, group_offsets, group_lengths, max_rows_per_file, filename_prefix)),
+        "total_groups": len(group_names),
+    }
+
+def write_groups_to_zip(plan, zip_buffer, on_progress=None, throttle_seconds: float = 0.0, use_zstd=False):
+    """Serialize the planned CSV files, writing each one straight into a ZIP archive"""
+    table, total_groups = plan["table"], plan["total_groups"]
+    filenames = []
     
-    # Process each group
-    for group_idx, (group_name, group_data) in enumerate(grouped):
-        total_groups += 1
-        
-        # Update progress
-        if status_text:
-            status_text.text(f"Processing group {total_groups}/{total_expected_groups}: {group_name}")
-        if progress_bar:
-            progress_bar.progress((group_idx + 1) / total_expected_groups)
-        
-        # Handle group name formatting
-        if isinstance(group_name, tuple):
-            group_name_str = "_".join([str(x).replace(" ", "_").replace("/", "_") for x in group_name])
-        else:
-            group_name_str = str(group_name).replace(" ", "_").replace("/", "_")
-        
-        # Remove any problematic characters for filename
-        group_name_str = "".join(c for c in group_name_str if c.isalnum() or c in ('_', '-'))
+    with open_zip_archive(zip_buffer, use_zstd) as zip_file, ThreadPoolExecutor(max_workers=SERIALIZE_WORKERS) as executor:
+        # Zstandard runs on all cores for each file
+        compressor = zstandard.ZstdCompressor(level=3, threads=-1) if use_zstd else None
+        date_time = time.localtime()[:6]
         
-        # Split group into multiple files if it exceeds max_rows_per_file
-        num_rows = len(group_data)
-        if num_rows <= max_rows_per_file:
-            # Single file for this group
-            filename = f"{group_name_str}.csv"
-            csv_content = group_data.to_csv(index=False)
-            csv_files.append((filename, csv_content))
-            total_files += 1
-        else:
-            # Multiple files for this group
-            num_chunks = (num_rows + max_rows_per_file - 1) // max_rows_per_file
-            for i in range(num_chunks):
-                start_idx = i * max_rows_per_file
-                end_idx = min((i + 1) * max_rows_per_file, num_rows)
-                chunk_data = group_data.iloc[start_idx:end_idx]
+        def write_next_batch():
+            """Write the oldest serialized batch into the archive, in submission order"""
+            batch, future = pending.popleft()
+            for (group_idx, group_name, filename, offset, num_rows, is_last_file), body in zip(batch, future.result()):
+                filenames.append(write_zip_entry(zip_file, filename, header + body, date_time, compressor))
                 
-                filename = f"{group_name_str}_part_{i+1}.csv"
-                csv_content = chunk_data.to_csv(index=False)
-                csv_files.append((filename, csv_content))
-                total_files += 1
-        
-        # Add 5-second delay after processing each group (for Streamlit Cloud timeout handling)
-        if status_text:
-            status_text.text(f"✅ Completed group {total_groups}/{total_expected_groups}: {group_name} | Waiting 5 seconds...")
+                if is_last_file:
+                    # Update progress
+                    if on_progress:
+                        on_progress((group_idx + 1) / total_groups, f"Processing group {group_idx + 1}/{total_groups}: {group_name}")
+                    
+                    # Optional pause between groups (off by default)
+                    if throttle_seconds > 0:
+                        time.sleep(throttle_seconds)
         
-        # Sleep for 5 seconds to prevent timeout issues
-        time.sleep(5)
+        # Render batches of files on worker threads (Arrow releases the GIL) while this thread writes them in order
+        header = csv_header(table.schema)
+        files = iter(plan["files"])
+        pending = deque()
+        while batch := list(islice(files, FILES_PER_BATCH)):
+            file_rows = [(offset, num_rows) for _, _, _, offset, num_rows, _ in batch]
+            pending.append((batch, executor.submit(render_csv_batch, table, file_rows)))
+            
+            # Keep only a few batches in flight so memory stays bounded
+            if len(pending) >= 2 * SERIALIZE_WORKERS:
+                write_next_batch()
+        while pending:
+            write_next_batch()
+    
+    return filenames
+
+def stream_groups_to_zip(df, group_columns, selected_columns, max_rows_per_file, zip_buffer, on_progress=None, throttle_seconds: float = 0.0, filename_prefix="", use_zstd=False):
+    """Split the dataframe into CSV files based on grouping criteria, writing each one straight into a ZIP archive"""
+    plan = plan_groups(df, group_columns, selected_columns, max_rows_per_file, on_progress, filename_prefix)
+    filenames = write_groups_to_zip(plan, zip_buffer, on_progress, throttle_seconds, use_zstd)
+    return filenames, plan["total_groups"], len(filenames)
+
+def run_split_job(df, group_columns, selected_columns, max_rows_per_file, progress, throttle_seconds: float = 0.0, filename_prefix="", use_zstd=False):
+    """Build the ZIP archive on a background thread, reporting progress through the shared progress dict"""
+    def report(fraction, message):
+        # The page sets 'cancelled' when the inputs change, so stop instead of finishing unused work
+        if progress.get("cancelled"):
+            raise RuntimeError("Split job was cancelled")
+        progress.update(fraction=fraction, message=message)
+    
+    zip_buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    filenames, total_groups, total_files = stream_groups_to_zip(
+        df, group_columns, selected_columns, max_rows_per_file, zip_buffer,
+        report, throttle_seconds, filename_prefix, use_zstd
+    )
+    return {
+        "zip_buffer": zip_buffer,
+        "zip_size": zip_buffer.tell(),
+        "filenames": filenames,
+        "total_groups": total_groups,
+        "total_files": total_files,
+    }
+
+def read_zip(zip_buffer):
+    """Read the finished archive back when the user clicks download"""
+    # The archive stays spooled (on disk once large) until then; Streamlit needs it as bytes
+    zip_buffer.seek(0)
+    return zip_buffer.read()
+
+def cancel_split_job():
+    """Cancel the current split job, if any, and drop its results"""
+    job = st.session_state.pop("split_job", None)
+    if job is not None:
+        # A running job stops at its next progress update, freeing the worker for the next one
+        job["progress"]["cancelled"] = True
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job):
+    """Redraw the progress of a running split job until it finishes"""
+    if job["future"].done():
+        # Rerun the whole page to show the results
+        st.rerun()
+    
+    st.progress(job["progress"]["fraction"])
+    st.text(job["progress"]["message"])
+
+@st.cache_data(show_spinner=False)
+def load_sheet_names(file_bytes):
+    """Read the sheet names of an uploaded Excel file"""
+    return pd.ExcelFile(BytesIO(file_bytes), engine="calamine").sheet_names
+
+# Only the current sheet's preview and full frame stay cached, so switching files or sheets frees the old ones
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_excel(file_bytes, sheet_name, nrows=None):
+    """Parse one sheet of an uploaded Excel file, cached by file contents so reruns skip re-parsing"""
+    df = pd.read_excel(BytesIO(file_bytes), sheet_name=sheet_name, engine="calamine", nrows=nrows)
     
-    return csv_files, total_groups, total_files
+    # Store text as Arrow strings (contiguous UTF-8) instead of one Python object per cell
+    text_columns = df.select_dtypes("object").columns
+    df[text_columns] = df[text_columns].astype("string[pyarrow]")
+    return df
+
+@st.cache_data(show_spinner=False)
+def group_sizes(_df, file_id, sheet_name, group_columns):
+    """Count the rows in each group the split will create, cached per file, sheet and grouping"""
+    # One hash-based pass gives both the number of groups and a preview with row counts
+    return _df.groupby(list(group_columns), sort=False, observed=True).size()
 
 def main():
     st.set_page_config(
@@ -139,8 +443,8 @@ def main():
             # Load the Excel file to check for multiple sheets
             with st.spinner("Loading Excel file..."):
                 # Read Excel file to get sheet names
-                excel_file = pd.ExcelFile(uploaded_file)
-                sheet_names = excel_file.sheet_names
+                file_bytes = uploaded_file.getvalue()
+                sheet_names = load_sheet_names(file_bytes)
                 
                 # Check if multiple sheets exist
                 if len(sheet_names) > 1:
@@ -154,76 +458,35 @@ def main():
                         help="Select the specific sheet/tab from your Excel file to process"
                     )
                     
-                    # Load the selected sheet
-                    df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+                    # Only read the first rows for the preview and column discovery
+                    preview_df = load_excel(file_bytes, selected_sheet, nrows=PREVIEW_ROWS)
                     
-                    st.success(f"✅ Sheet '{selected_sheet}' loaded successfully! Shape: {df.shape[0]:,} rows × {df.shape[1]} columns")
+                    st.success(f"✅ Sheet '{selected_sheet}' loaded successfully! Found {preview_df.shape[1]} columns")
                     
                 else:
                     # Single sheet - load directly
                     selected_sheet = sheet_names[0]
-                    df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
-                    st.success(f"✅ File loaded successfully! Sheet: '{selected_sheet}' | Shape: {df.shape[0]:,} rows × {df.shape[1]} columns")
-            
-            # Check for empty rows and show cleaning preview
-            empty_rows_count = df.isnull().all(axis=1).sum()
-            mostly_empty_rows = df.isnull().sum(axis=1) >= (len(df.columns) * 0.8)
-            mostly_empty_count = mostly_empty_rows.sum()
-            
-            if empty_rows_count > 0 or mostly_empty_count > 0:
-                st.info(f"🧹 **Data Cleaning Preview**: Found {empty_rows_count} completely empty rows and {mostly_empty_count} mostly empty rows (80%+ empty). These will be automatically removed during processing.")
-            else:
-                st.success("✨ **Data Quality**: No empty rows detected - your data looks clean!")
-            
-            # Display basic info about the file
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Selected Sheet", selected_sheet)
-            with col2:
-                st.metric("Total Rows", f"{df.shape[0]:,}")
-            with col3:
-                st.metric("Total Columns", df.shape[1])
-            with col4:
-                clean_rows = df.shape[0] - df.isnull().all(axis=1).sum()
-                st.metric("Clean Rows", f"{clean_rows:,}", delta=f"-{df.isnull().all(axis=1).sum()}" if df.isnull().all(axis=1).sum() > 0 else None)
+                    preview_df = load_excel(file_bytes, selected_sheet, nrows=PREVIEW_ROWS)
+                    st.success(f"✅ File loaded successfully! Sheet: '{selected_sheet}' | Found {preview_df.shape[1]} columns")
             
             # Preview data
             next_section = "3. Data Preview" if len(sheet_names) > 1 else "2. Data Preview"
             st.header(next_section)
             with st.expander("👀 View first 10 rows", expanded=False):
-                st.dataframe(df.head(10))
+                st.dataframe(preview_df.head(10))
             
             # Column selection for grouping
             next_section = "4. Select Grouping Columns" if len(sheet_names) > 1 else "3. Select Grouping Columns"
             st.header(next_section)
             st.markdown("Choose one or more columns to group by. Each unique combination will create separate CSV files.")
             
-            available_columns = df.columns.tolist()
+            available_columns = preview_df.columns.tolist()
             group_columns = st.multiselect(
                 "Select columns for grouping:",
                 available_columns,
                 help="You can select multiple columns. Each unique combination of values will create a separate file."
             )
             
-            if group_columns:
-                # Show preview of unique combinations
-                if len(group_columns) == 1:
-                    unique_combos = df[group_columns[0]].nunique()
-                    preview_combos = df[group_columns[0]].unique()[:10]
-                else:
-                    unique_combos = df[group_columns].drop_duplicates().shape[0]
-                    preview_combos = df[group_columns].drop_duplicates().head(10)
-                
-                st.info(f"📈 This will create approximately **{unique_combos}** different groups")
-                
-                with st.expander(f"Preview of unique combinations (showing first 10)", expanded=False):
-                    if len(group_columns) == 1:
-                        st.write("Unique values:")
-                        for combo in preview_combos:
-                            st.write(f"• {combo}")
-                    else:
-                        st.dataframe(preview_combos)
-            
             # Column selection for output
             next_section = "5. Select Columns for Output" if len(sheet_names) > 1 else "4. Select Columns for Output"
             st.header(next_section)
@@ -236,8 +499,54 @@ def main():
                 help="Select the columns you want to include in the output CSV files"
             )
             
+            if group_columns and selected_columns:
+                # Parse the full sheet once; changing the column selection only picks columns from the cached frame.
+                # Select by position: header labels may be numbers, which pandas would read as positions
+                used_columns = [i for i, col in enumerate(available_columns) if col in group_columns or col in selected_columns]
+                with st.spinner("Loading sheet..."):
+                    df = load_excel(file_bytes, selected_sheet).iloc[:, used_columns]
+                
+                next_section = "6. Data Summary" if len(sheet_names) > 1 else "5. Data Summary"
+                st.header(next_section)
+                
+                # Check for empty rows and show cleaning preview
+                empty_rows_count = df.isnull().all(axis=1).sum()
+                mostly_empty_rows = df.isnull().sum(axis=1) >= (len(df.columns) * 0.8)
+                mostly_empty_count = mostly_empty_rows.sum()
+                
+                if empty_rows_count > 0 or mostly_empty_count > 0:
+                    st.info(f"🧹 **Data Cleaning Preview**: Found {empty_rows_count} completely empty rows and {mostly_empty_count} mostly empty rows (80%+ empty). These will be automatically removed during processing.")
+                else:
+                    st.success("✨ **Data Quality**: No empty rows detected - your data looks clean!")
+                
+                # Display basic info about the file
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Selected Sheet", selected_sheet)
+                with col2:
+                    st.metric("Total Rows", f"{df.shape[0]:,}")
+                with col3:
+                    st.metric("Total Columns", len(available_columns))
+                with col4:
+                    clean_rows = df.shape[0] - empty_rows_count
+                    st.metric("Clean Rows", f"{clean_rows:,}", delta=f"-{empty_rows_count}" if empty_rows_count > 0 else None)
+                
+                # Show preview of unique combinations
+                sizes = group_sizes(df, uploaded_file.file_id, selected_sheet, tuple(group_columns))
+                preview_combos = sizes.head(10)
+                
+                st.info(f"📈 This will create approximately **{len(sizes)}** different groups")
+                
+                with st.expander(f"Preview of unique combinations (showing first 10)", expanded=False):
+                    if len(group_columns) == 1:
+                        st.write("Unique values:")
+                        for combo, rows in preview_combos.items():
+                            st.write(f"• {combo} ({rows:,} rows)")
+                    else:
+                        st.dataframe(preview_combos.rename("Rows").reset_index())
+            
             # Additional settings
-            next_section = "6. Additional Settings" if len(sheet_names) > 1 else "5. Additional Settings"
+            next_section = "7. Additional Settings" if len(sheet_names) > 1 else "6. Additional Settings"
             st.header(next_section)
             col1, col2 = st.columns(2)
             
@@ -257,135 +566,162 @@ def main():
                     value=False,
                     help="Add current timestamp to avoid filename conflicts"
                 )
+                use_zstd = st.checkbox(
+                    "Use Zstandard compression",
+                    value=False,
+                    help="Faster and smaller than standard ZIP compression. Files are stored as .csv.zst inside the ZIP "
+                         "and need a Zstandard tool such as 7-Zip or zstd to open."
+                )
+            
+            throttle_seconds = st.sidebar.number_input(
+                "Throttle (s/group, 0 = off)",
+                min_value=0.0,
+                max_value=10.0,
+                value=0.0,
+                step=0.5,
+                help="Optional pause after each group. Leave at 0 for fastest processing."
+            )
             
             # Process button
             if group_columns and selected_columns:
-                next_section = "7. Generate CSV Files" if len(sheet_names) > 1 else "6. Generate CSV Files"
+                next_section = "8. Generate CSV Files" if len(sheet_names) > 1 else "7. Generate CSV Files"
                 st.header(next_section)
                 
+                # Everything that shapes the output; a job only applies while these stay the same
+                job_inputs = {
+                    "file_id": uploaded_file.file_id,
+                    "sheet": selected_sheet,
+                    "group_columns": group_columns,
+                    "selected_columns": selected_columns,
+                    "max_rows_per_file": max_rows_per_file,
+                    "include_timestamp": include_timestamp,
+                    "use_zstd": use_zstd,
+                }
+                
                 if st.button("🚀 Generate CSV Files", type="primary"):
-                    # Create progress indicators
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Estimate processing time
-                    if len(group_columns) == 1:
-                        estimated_groups = df[group_columns[0]].nunique()
-                    else:
-                        estimated_groups = df[group_columns].drop_duplicates().shape[0]
+                    filename_prefix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_" if include_timestamp else ""
                     
-                    estimated_time_minutes = (estimated_groups * 5) / 60
-                    st.info(f"⏱️ Estimated processing time: {estimated_time_minutes:.1f} minutes ({estimated_groups} groups × 5 seconds each)")
+                    # A new click replaces any job still running, so it doesn't hold the worker
+                    cancel_split_job()
                     
-                    with st.spinner("Processing data and creating CSV files..."):
-                        try:
-                            csv_files, total_groups, total_files = process_excel_data(
-                                df, group_columns, selected_columns, max_rows_per_file, 
-                                progress_bar, status_text
-                            )
-                            
-                            # Clear progress indicators
-                            progress_bar.empty()
-                            status_text.empty()
-                            
-                            if include_timestamp:
-                                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                csv_files = [(f"{timestamp}_{filename}", content) for filename, content in csv_files]
-                            
-                            # Create ZIP file
-                            with st.spinner("Creating ZIP file for download..."):
-                                zip_buffer = create_zip_download(csv_files)
-                            
-                            # Success message
-                            st.success(f"✅ Successfully created {total_files} CSV files from {total_groups} unique groups!")
-                            
-                            # Summary statistics
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("Groups Created", total_groups)
-                            with col2:
-                                st.metric("CSV Files Generated", total_files)
-                            with col3:
-                                st.metric("ZIP File Size", f"{len(zip_buffer.getvalue()) / (1024*1024):.2f} MB")
-                            
-                            # Download button
-                            st.download_button(
-                                label="📥 Download All CSV Files (ZIP)",
-                                data=zip_buffer.getvalue(),
-                                file_name=f"split_csvs_{selected_sheet}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                                mime="application/zip",
-                                type="primary"
-                            )
-                            
-                            # Show file list
-                            with st.expander("📁 List of generated files", expanded=False):
-                                for i, (filename, _) in enumerate(csv_files, 1):
-                                    st.write(f"{i}. {filename}")
-                                    
-                        except Exception as e:
-                            # Clear progress indicators on error
-                            progress_bar.empty()
-                            status_text.empty()
-                            
-                            # Show detailed error information for debugging
-                            st.error(f"❌ Error processing data: {str(e)}")
-                            
-                            # Show error details in expandable section
-                            with st.expander("🔍 Error Details (for debugging)", expanded=False):
-                                st.code(f"""
+                    # Run the split on a background thread so the page stays responsive
+                    if "split_executor" not in st.session_state:
+                        st.session_state["split_executor"] = ThreadPoolExecutor(max_workers=1)
+                    progress = {"fraction": 0.0, "message": "Starting..."}
+                    st.session_state["split_job"] = {
+                        "future": st.session_state["split_executor"].submit(
+                            run_split_job, df, group_columns, selected_columns, max_rows_per_file,
+                            progress, throttle_seconds, filename_prefix, use_zstd
+                        ),
+                        "progress": progress,
+                        "inputs": job_inputs,
+                        "shape": df.shape,
+                    }
+                
+                job = st.session_state.get("split_job")
+                if job is not None and job["inputs"] != job_inputs:
+                    # The file or settings changed since this job started: cancel it and drop its results
+                    cancel_split_job()
+                    job = None
+                
+                if job is not None and not job["future"].done():
+                    st.caption("Processing data and creating CSV files...")
+                    show_job_progress(job)
+                
+                elif job is not None:
+                    try:
+                        result = job["future"].result()
+                        
+                        # Success message
+                        st.success(f"✅ Successfully created {result['total_files']} CSV files from {result['total_groups']} unique groups!")
+                        
+                        # Summary statistics
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Groups Created", result["total_groups"])
+                        with col2:
+                            st.metric("CSV Files Generated", result["total_files"])
+                        with col3:
+                            st.metric("ZIP File Size", f"{result['zip_size'] / (1024*1024):.2f} MB")
+                        
+                        # Download button: the archive is only read back into memory once the user clicks it
+                        st.download_button(
+                            label="📥 Download All CSV Files (ZIP)",
+                            data=functools.partial(read_zip, result["zip_buffer"]),
+                            file_name=f"split_csvs_{job['inputs']['sheet']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                            mime="application/zip",
+                            on_click="ignore",
+                            type="primary"
+                        )
+                        
+                        # Show file list
+                        with st.expander("📁 List of generated files", expanded=False):
+                            for i, filename in enumerate(result["filenames"], 1):
+                                st.write(f"{i}. {filename}")
+                                
+                    except Exception as e:
+                        # Show detailed error information for debugging
+                        st.error(f"❌ Error processing data: {str(e)}")
+                        
+                        # Show error details in expandable section
+                        with st.expander("🔍 Error Details (for debugging)", expanded=False):
+                            st.code(f"""
 Error Type: {type(e).__name__}
 Error Message: {str(e)}
 
 Debug Information:
-- DataFrame shape: {df.shape if 'df' in locals() else 'Unknown'}
-- Group columns: {group_columns}
-- Selected columns: {selected_columns}
-- Max rows per file: {max_rows_per_file}
-                                """)
-                                
-                                # Show full traceback
-                                import traceback
-                                st.text("Full Traceback:")
-                                st.code(traceback.format_exc())
-                            
-                            # Suggest solutions
-                            st.info("""
-                            💡 **Possible Solutions:**
-                            - Check if your group columns contain valid data (no all-empty columns)
-                            - Ensure selected columns exist in the data
-                            - Try with fewer rows by filtering your data first
-                            - Check if there are special characters in your data causing issues
-                            - Verify your Excel file isn't corrupted
+- DataFrame shape: {job["shape"]}
+- Group columns: {job["inputs"]["group_columns"]}
+- Selected columns: {job["inputs"]["selected_columns"]}
+- Max rows per file: {job["inputs"]["max_rows_per_file"]}
                             """)
                             
-                            # Add a test button for basic functionality
-                            if st.button("🧪 Test with Sample Data", help="Test the app with a small sample of your data"):
-                                try:
-                                    # Create a small test sample
-                                    test_df = df.head(10)
-                                    st.write("Testing with first 10 rows:")
-                                    st.dataframe(test_df)
-                                    
-                                    # Try processing the sample
-                                    test_csv_files, test_groups, test_files = process_excel_data(
-                                        test_df, group_columns, selected_columns, max_rows_per_file
-                                    )
-                                    st.success(f"✅ Sample test successful! Created {test_files} files from {test_groups} groups")
-                                    
-                                except Exception as test_e:
-                                    st.error(f"❌ Sample test also failed: {str(test_e)}")
-                                    st.code(traceback.format_exc())
+                            # Show full traceback
+                            st.text("Full Traceback:")
+                            st.code("".join(traceback.format_exception(e)))
+                        
+                        # Suggest solutions
+                        st.info("""
+                        💡 **Possible Solutions:**
+                        - Check if your group columns contain valid data (no all-empty columns)
+                        - Ensure selected columns exist in the data
+                        - Try with fewer rows by filtering your data first
+                        - Check if there are special characters in your data causing issues
+                        - Verify your Excel file isn't corrupted
+                        """)
+                        
+                        # Add a test button for basic functionality
+                        if st.button("🧪 Test with Sample Data", help="Test the app with a small sample of your data"):
+                            try:
+                                # Create a small test sample
+                                test_df = df.head(10)
+                                st.write("Testing with first 10 rows:")
+                                st.dataframe(test_df)
+                                
+                                # Try processing the sample
+                                test_filenames, test_groups, test_files = stream_groups_to_zip(
+                                    test_df, group_columns, selected_columns, max_rows_per_file, BytesIO()
+                                )
+                                st.success(f"✅ Sample test successful! Created {test_files} files from {test_groups} groups")
+                                
+                            except Exception as test_e:
+                                st.error(f"❌ Sample test also failed: {str(test_e)}")
+                                st.code(traceback.format_exc())
             else:
+                # Without grouping or output columns no job can match the page
+                cancel_split_job()
                 if not group_columns:
                     st.warning("⚠️ Please select at least one grouping column.")
                 if not selected_columns:
                     st.warning("⚠️ Please select at least one column for output.")
         
         except Exception as e:
+            cancel_split_job()
             st.error(f"❌ Error loading file: {str(e)}")
             st.error("Please make sure you uploaded a valid Excel file.")
     
     else:
+        cancel_split_job()
         st.info("👆 Please upload an Excel file to get started.")
     
     # Instructions
@@ -394,9 +730,9 @@ Debug Information:
         st.markdown("""
         1. **Upload** your Excel file (xlsx or xls)
         2. **Select sheet** (if multiple sheets exist)
-        3. **Review** data cleaning preview (empty rows detection)
-        4. **Select grouping columns** - each unique combination creates a separate CSV
-        5. **Choose output columns** - select which columns to include in CSV files
+        3. **Select grouping columns** - each unique combination creates a separate CSV
+        4. **Choose output columns** - select which columns to include in CSV files
+        5. **Review** data summary (empty rows detection and group count)
         6. **Set max rows per file** - files larger than this will be split
         7. **Generate and download** the ZIP file containing all CSV files
         """)
@@ -415,7 +751,7 @@ Debug Information:
         st.header("⚙️ Technical Info")
         st.markdown(f"""
         - **Max file size**: ~200MB Excel files
-        - **Processing**: 5-second delay between groups (for cloud stability)
+        - **Processing**: No delay between groups (optional throttle in settings)
         - **Memory efficient**: Processes data in chunks
         - **Output format**: CSV files in ZIP archive
         - **Cloud optimized**: Prevents timeout issues
@@ -423,10 +759,10 @@ Debug Information:
 
         st.header("⚠️ Cloud Processing Notes")
         st.markdown("""
-        - **Processing time**: ~5 seconds per unique group
-        - **Large datasets**: May take several minutes
+        - **Processing time**: Scales with data size, not group count
+        - **Large datasets**: May take a little longer
         - **Progress tracking**: Real-time status updates
-        - **Timeout prevention**: Built-in delays for stability
+        - **Throttle**: Optional per-group pause if your host needs it
         """)
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from streamlit_app import csv_header, render_csv_batch
+
+
+def rendered_files(df, file_rows):
+    """Render consecutive slices of a frame the way the archive writer does"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    header = csv_header(table.schema)
+    return [header + bytes(body) for body in render_csv_batch(table, file_rows)]
+
+
+def expected_files(df, file_rows):
+    """Render the same slices with pandas' to_csv"""
+    return [df.iloc[offset:offset + num_rows].to_csv(index=False).encode() for offset, num_rows in file_rows]
+
+
+def test_matches_pandas_for_calamine_dtypes():
+    # One column per dtype calamine produces; the second file has only midnights and whole days
+    df = pd.DataFrame({
+        "int": [1, -2, 30, 4, 5],
+        "float": [1.0, np.nan, 0.1, 1e-05, 2.5e20],
+        "text": ["plain", "a, b", 'say "hi"', "two\nlines", "cr\rx"],
+        "bool": [True, False, True, False, True],
+        "when": pd.to_datetime(["2024-01-05 13:45:10.250", None, "2024-01-06", "2024-01-07", "2024-01-08"], format="ISO8601"),
+        "duration": pd.to_timedelta(["01:30:00", None, "-00:00:01.5", "1 days", "2 days"]),
+        "time": [datetime.time(1, 30), None, datetime.time(0, 0, 1, 500), datetime.time(23, 59), datetime.time(12)],
+    })
+    df["text"] = df["text"].astype("string[pyarrow]")
+    file_rows = [(0, 3), (3, 2)]
+
+    assert rendered_files(df, file_rows) == expected_files(df, file_rows)
+
+
+def test_header_labels_are_quoted_like_pandas():
+    df = pd.DataFrame({"plain": [1], "with, comma": [2], 2024: [3]})
+
+    assert rendered_files(df, [(0, 1)]) == expected_files(df, [(0, 1)])